@@ -1,14 +1,99 @@
 from __future__ import annotations
 
+import ast
+import asyncio
+import functools
 import os
-from typing import Optional
+import re
+import string
+from typing import Optional, Tuple
 
-from tools import Tools, PermissionManager
+from tools import Tools, PermissionManager, parse_cache
 from memory import ContextStore
 from repo_utils import search_in_repo
 from llm import LLMClient
 
 
+# Trigger patterns are compiled once at import time: a single regex
+# alternation makes one pass over the message instead of one substring
+# scan per keyword.
+_CLARIFY_RE = re.compile(r"expected|should|want|instead", re.IGNORECASE)
+_ZERO_DIV_RE = re.compile(
+    r"zerodivisionerror|divi(?:sion|de)\s+by\s+zero|divide\(10,\s*0\)|b\s*==?\s*0",
+    re.IGNORECASE,
+)
+
+# Constant message frame prepared once; per-analysis work is a single
+# template substitution.
+_ANALYSIS_TMPL = string.Template(
+    "Bug analysis summary for $bug_id:\n"
+    "- Location: $target_file\n"
+    "- Root cause: $root_cause\n"
+    "- Proposed fix: $proposed_fix\n\n"
+    "If this looks good, I will apply the fix, add tests, "
+    "and then ask permission before running pytest."
+)
+
+
+@functools.lru_cache(maxsize=512)
+def _classify(report_lower: str) -> Optional[Tuple[str, str]]:
+    """
+    Heuristic report classifier. Takes the already-lowercased report so
+    identical reports across a session resolve to a cached
+    (root_cause, proposed_fix) tuple instead of being re-scanned.
+    """
+    if _ZERO_DIV_RE.search(report_lower):
+        return (
+            "The divide(a, b) function performs division without "
+            "checking if b is zero, causing a ZeroDivisionError.",
+            "Add an explicit check for b == 0 and raise a clear ValueError.",
+        )
+    return None
+
+
+def _has_zero_guard(func: ast.FunctionDef) -> bool:
+    for node in ast.walk(func):
+        if isinstance(node, ast.Compare):
+            names = [n.id for n in ast.walk(node) if isinstance(n, ast.Name)]
+            consts = [c.value for c in ast.walk(node) if isinstance(c, ast.Constant)]
+            if "b" in names and 0 in consts:
+                return True
+    return False
+
+
+@functools.lru_cache(maxsize=64)
+def _apply_divide_guard(code: str) -> str:
+    """
+    Structurally insert a `b == 0` guard at the top of divide().
+
+    Works off the (cached) AST rather than exact substring matches, so
+    the transform survives formatting drift, and splices the guard into
+    the original source lines so comments/layout are preserved.
+    Returns the source unchanged if divide() is missing or already
+    guarded. Memoized: re-fixing identical source is a dict lookup.
+    """
+    try:
+        tree = parse_cache.parse(code)
+    except SyntaxError:
+        return code
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name == "divide":
+            if _has_zero_guard(node):
+                return code
+            first = node.body[0]
+            indent = " " * first.col_offset
+            guard = (
+                f"{indent}if b == 0:\n"
+                f'{indent}    raise ValueError("Cannot divide by zero")\n'
+            )
+            lines = code.splitlines(keepends=True)
+            insert_at = first.lineno - 1
+            return "".join(lines[:insert_at] + [guard] + lines[insert_at:])
+
+    return code
+
+
 class BugFixerAgent:
     """
     Conversational Bug Fixing Agent (CLI)
@@ -22,21 +107,28 @@ class BugFixerAgent:
     - Final summarization
     """
 
-    def __init__(self, tools: Tools, memory: ContextStore) -> None:
+    def __init__(self, tools: Tools, memory: ContextStore, use_llm: bool = True) -> None:
         self.tools = tools
         self.mem = memory
         self.llm = LLMClient()  # 🔹 LLM is optional and pluggable
+        # Single module serves both modes: LLM-assisted and pure
+        # heuristic, selected at construction time.
+        self.use_llm = use_llm
         self.active_bug_id: Optional[str] = None
 
     # =========================
     # CLI UI LOOP
     # =========================
     def chat(self) -> None:
+        asyncio.run(self.chat_async())
+
+    async def chat_async(self) -> None:
         print("Bug Fixer Agent (CLI)")
         print("Type 'help' for commands, 'exit' to quit.\n")
 
         while True:
-            user = input("You: ").strip()
+            # input() runs in a worker thread so the event loop stays free.
+            user = (await asyncio.to_thread(input, "You: ")).strip()
 
             if user.lower() in ("exit", "quit"):
                 print("Agent: Bye.")
@@ -51,11 +143,11 @@ class BugFixerAgent:
                 continue
 
             if user.lower() == "run-tests":
-                self._run_tests_flow()
+                await self._run_tests_flow_async()
                 continue
 
             self.mem.add_turn("user", user)
-            self._handle_user_message(user)
+            await asyncio.to_thread(self._handle_user_message, user)
 
     def _show_help(self) -> None:
         print(
@@ -81,6 +173,21 @@ class BugFixerAgent:
             self._ask_clarifying(bug.bug_id)
             return
 
+        bug = self.mem.get_bug(self.active_bug_id)
+
+        # Same message as last time with an analysis already in hand:
+        # replay the cached summary instead of re-reading the file and
+        # re-invoking the LLM.
+        msg_hash = hash(user_msg)
+        if msg_hash == bug.analysis_hash and bug.root_cause and bug.analysis_text:
+            self.mem.add_turn("agent", bug.analysis_text)
+            print(f"Agent: {bug.analysis_text}")
+            return
+
+        if _CLARIFY_RE.search(user_msg):
+            bug.expected_behavior = user_msg
+
+        bug.analysis_hash = msg_hash
         self._analyze_and_propose(self.active_bug_id)
 
     def _ask_clarifying(self, bug_id: str) -> None:
@@ -97,12 +204,21 @@ class BugFixerAgent:
     # ANALYSIS (LLM + FALLBACK)
     # =========================
     def _analyze_and_propose(self, bug_id: str) -> None:
-        bug = next(b for b in self.mem.bugs if b.bug_id == bug_id)
+        bug = self.mem.get_bug(bug_id)
 
         target_file = "demo_repo/src/calculator.py"
 
-
-        ok, code = self.tools.read_file(target_file)
+        # Batch-read the primary target together with any other candidate
+        # files mentioning divide() so the reads overlap instead of
+        # happening one after another.
+        target_abs = os.path.join(self.tools.root_dir, target_file)
+        candidates = [target_file]
+        for hit in search_in_repo(os.path.dirname(target_abs), "def divide"):
+            if hit != target_abs:
+                candidates.append(hit)
+        contents = asyncio.run(self.tools.read_files(candidates))
+
+        ok, code = contents[target_file]
         print("DEBUG: Reading file:", target_file)
         print("DEBUG: File contents:\n", code)
         if not ok:
@@ -114,12 +230,14 @@ class BugFixerAgent:
         root_cause = ""
         proposed_fix = ""
 
-        #Attempt LLM-based reasoning FIRST
-        llm_result = self.llm.analyze_bug(
-            user_report=bug.user_report,
-            code_snippet=code,
-            file_path=target_file,
-        )
+        #Attempt LLM-based reasoning FIRST (when enabled for this agent)
+        llm_result = None
+        if self.use_llm and self.llm.enabled:
+            llm_result = self.llm.analyze_bug(
+                user_report=bug.user_report,
+                code_snippet=code,
+                file_path=target_file,
+            )
 
         if llm_result:
             root_cause = llm_result["root_cause"]
@@ -127,7 +245,13 @@ class BugFixerAgent:
 
         # 🔹 Deterministic fallback if LLM unavailable
         if not root_cause:
-            if "divide(" in code and "return a / b" in code:
+            # Lowercase the report once and classify via the cached helper
+            # so repeated identical reports skip re-analysis entirely.
+            low = bug.user_report.lower()
+            classified = _classify(low)
+            if classified:
+                root_cause, proposed_fix = classified
+            elif "divide(" in code and "return a / b" in code:
                 root_cause = (
                     "The divide(a, b) function performs division without "
                     "checking if b is zero, causing a ZeroDivisionError."
@@ -162,15 +286,14 @@ class BugFixerAgent:
         bug.proposed_fix = proposed_fix
 
         #REQUIRED: summarize BEFORE fixing
-        analysis = (
-            f"Bug analysis summary for {bug_id}:\n"
-            f"- Location: {target_file}\n"
-            f"- Root cause: {root_cause}\n"
-            f"- Proposed fix: {proposed_fix}\n\n"
-            "If this looks good, I will apply the fix, add tests, "
-            "and then ask permission before running pytest."
+        analysis = _ANALYSIS_TMPL.substitute(
+            bug_id=bug_id,
+            target_file=target_file,
+            root_cause=root_cause,
+            proposed_fix=proposed_fix,
         )
 
+        bug.analysis_text = analysis
         self.mem.add_turn("agent", analysis)
         print(f"Agent: {analysis}")
 
@@ -181,7 +304,7 @@ class BugFixerAgent:
     # FIX + TESTS
     # =========================
     def _implement_fix_and_tests(self, bug_id: str) -> None:
-        bug = next(b for b in self.mem.bugs if b.bug_id == bug_id)
+        bug = self.mem.get_bug(bug_id)
 
         target_file = "demo_repo/src/calculator.py"
         ok, code = self.tools.read_file(target_file)
@@ -189,36 +312,33 @@ class BugFixerAgent:
             print(f"Agent: Failed to read {target_file}")
             return
 
-        if "b == 0" not in code:
-            # updated = code.replace(
-            #     "def divide(a: float, b: float) -> float:\n    return a / b\n",
-            #     "def divide(a: float, b: float) -> float:\n"
-            #     "    if b == 0:\n"
-            #     "        raise ValueError(\"Cannot divide by zero\")\n"
-            #     "    return a / b\n",
-            # )
-            if "def divide" in code and "b == 0" not in code:
-                updated = code.replace(
-                    "return a / b",
-                    "if b == 0:\n        raise ValueError(\"Cannot divide by zero\")\n    return a / b"
-                )
+        # Structural transform: the guard is placed via the AST instead of
+        # a brittle substring replace, so reformatted code still gets fixed.
+        updated = _apply_divide_guard(code)
+        if updated != code:
             self.tools.edit_file(target_file, updated)
             bug.files_changed.append(target_file)
+        else:
+            # No-op: the guard is already present; skip the disk write.
+            print(f"Agent: {target_file} already guarded, nothing to write.")
 
         test_file = "demo_repo/tests/test_calculator.py"
         ok, tests = self.tools.read_file(test_file)
         if not ok:
             tests = ""
 
+        desired_tests = tests
         if "test_divide_by_zero" not in tests:
-            tests += (
+            desired_tests = tests + (
                 "\n\nimport pytest\n"
                 "from src.calculator import divide\n\n"
                 "def test_divide_by_zero():\n"
                 "    with pytest.raises(ValueError):\n"
                 "        divide(10, 0)\n"
             )
-            self.tools.write_file(test_file, tests)
+
+        if desired_tests != tests:
+            self.tools.write_file(test_file, desired_tests)
             bug.tests_added.append(test_file)
 
         msg = (
@@ -231,17 +351,58 @@ class BugFixerAgent:
     # =========================
     # TEST EXECUTION
     # =========================
+    async def _run_tests_flow_async(self) -> None:
+        cached = self._cached_test_result()
+        if cached is not None:
+            self._record_test_result(cached)
+            return
+
+        # Streams pytest output line-by-line so the user sees progress
+        # instead of waiting for the whole run to finish.
+        result = await self.tools.bash_async(
+            "PYTHONPATH=demo_repo pytest -q",
+            on_line=lambda line: print(line),
+        )
+        self._store_test_result(result)
+        self._record_test_result(result, streamed=True)
+
     def _run_tests_flow(self) -> None:
+        cached = self._cached_test_result()
+        if cached is not None:
+            self._record_test_result(cached)
+            return
+
         #result = self.tools.bash("pytest -q")
         result = self.tools.bash("PYTHONPATH=demo_repo pytest -q")
+        self._store_test_result(result)
+        self._record_test_result(result)
+
+    def _cached_test_result(self):
+        cache = self.tools.test_cache
+        self._tree_key = cache.tree_hash(self.tools.root_dir)
+        return cache.get(self._tree_key)
+
+    def _store_test_result(self, result) -> None:
+        # Never cache a permission denial — the next attempt must ask
+        # again and actually run.
+        if result.returncode != 126:
+            self.tools.test_cache.put(self._tree_key, result)
 
+    def _record_test_result(self, result, streamed: bool = False) -> None:
         summary = "PASS" if result.ok else "FAIL"
         if self.mem.bugs:
             self.mem.bugs[-1].test_command = result.command
             self.mem.bugs[-1].test_result_summary = summary
+            # No add_turn follows on failure; make sure the next
+            # 'context' render shows the updated tracker state.
+            self.mem.mark_dirty()
 
         print("\nAgent: Test results:", summary)
-        print(result.stdout or result.stderr)
+        if not streamed:
+            # Streamed runs already printed every line live.
+            print(result.stdout or result.stderr)
+        elif not result.ok and result.stderr:
+            print(result.stderr)
 
         if result.ok:
             self._final_summary()
@@ -27,13 +27,94 @@
 
 from __future__ import annotations
 
+import hashlib
 import os
+import re
+import sqlite3
+import string
+import threading
 from typing import Optional
+import httpx
 from dotenv import load_dotenv
 from openai import OpenAI
 
 load_dotenv()
 
+_CACHE_PATH = ".bugfixer_cache.sqlite"
+
+# Compiled once: one C-level scan per field instead of a Python loop
+# over splitlines() with per-line lowercased copies.
+_ROOT_RE = re.compile(r"^\s*root cause\s*:\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+_FIX_RE = re.compile(r"^\s*proposed fix\s*:\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+
+# Constant prompt pieces built once at import time; per-call work is a
+# single template substitution rather than re-interpolating the frame.
+_SYSTEM_PROMPT = (
+    "You are a senior software engineer acting as a bug analysis agent.\n"
+    "You must only analyze and propose fixes.\n"
+    "Do NOT execute code.\n"
+    "Do NOT suggest running shell commands.\n"
+    "Be concise and precise."
+)
+
+_USER_TEMPLATE = string.Template(
+    "Bug report:\n"
+    "$report\n\n"
+    "File: $file\n\n"
+    "Code:\n"
+    "$code\n\n"
+    "Tasks:\n"
+    "1. Identify the root cause of the bug.\n"
+    "2. Propose a clean, maintainable fix.\n"
+)
+
+
+class AnalysisCache:
+    """
+    Persistent cache for analysis results, keyed by a content hash of
+    (user_report, code_snippet, file_path). A cache hit turns a network
+    round-trip into a local SQLite fetch. The model name is stored per
+    row so switching models transparently invalidates old entries.
+    """
+
+    def __init__(self, path: str = _CACHE_PATH) -> None:
+        # analyze_bug runs inside asyncio.to_thread worker threads, so
+        # the connection is shared across threads and serialized here.
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            "key TEXT NOT NULL, model TEXT NOT NULL, "
+            "root TEXT, fix TEXT, PRIMARY KEY (key, model))"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(user_report: str, code_snippet: str, file_path: str) -> str:
+        h = hashlib.sha256()
+        for part in (user_report, code_snippet, file_path):
+            h.update(part.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def get(self, key: str, model: str) -> Optional[dict]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT root, fix FROM analyses WHERE key=? AND model=?", (key, model)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"root_cause": row[0], "proposed_fix": row[1]}
+
+    def put(self, key: str, model: str, root: str, fix: str) -> None:
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, model, root, fix) VALUES (?,?,?,?)",
+                (key, model, root, fix),
+            )
+            self.conn.commit()
+
 
 class LLMClient:
     """
@@ -47,9 +128,36 @@ class LLMClient:
         api_key = os.getenv("OPENAI_API_KEY")
         self.enabled = bool(api_key)
         self.client: Optional[OpenAI] = None
+        self.model = "gpt-4o-mini"
+        self.cache: Optional[AnalysisCache] = None
+        self._http: Optional[httpx.Client] = None
 
         if self.enabled:
-            self.client = OpenAI(api_key=api_key)
+            # Shared connection pool: successive analyze_bug calls reuse
+            # warm TCP/TLS connections instead of re-handshaking.
+            self._http = self._build_http_client()
+            self.client = OpenAI(api_key=api_key, http_client=self._http)
+            self.cache = AnalysisCache()
+
+    @staticmethod
+    def _build_http_client() -> httpx.Client:
+        limits = httpx.Limits(max_connections=32, max_keepalive_connections=8)
+        try:
+            return httpx.Client(http2=True, timeout=30.0, limits=limits)
+        except ImportError:
+            # The h2 extra is not installed; keep-alive pooling still helps.
+            return httpx.Client(timeout=30.0, limits=limits)
+
+    def close(self) -> None:
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            pass
 
     def analyze_bug(
         self,
@@ -68,56 +176,80 @@ class LLMClient:
         if not self.enabled or not self.client:
             return None
 
-        system_prompt = (
-            "You are a senior software engineer acting as a bug analysis agent.\n"
-            "You must only analyze and propose fixes.\n"
-            "Do NOT execute code.\n"
-            "Do NOT suggest running shell commands.\n"
-            "Be concise and precise."
+        # Unchanged report + code + path → serve the stored analysis
+        # instead of paying for another API round-trip.
+        key = AnalysisCache.make_key(user_report, code_snippet, file_path)
+        if self.cache:
+            cached = self.cache.get(key, self.model)
+            if cached is not None:
+                return cached
+
+        user_prompt = _USER_TEMPLATE.substitute(
+            report=user_report,
+            file=file_path,
+            code=code_snippet,
         )
 
-        user_prompt = f"""
-Bug report:
-{user_report}
-
-File: {file_path}
-
-Code:
-{code_snippet}
-
-Tasks:
-1. Identify the root cause of the bug.
-2. Propose a clean, maintainable fix.
-"""
-
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
+        stream = self.client.chat.completions.create(
+            model=self.model,
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": _SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt},
             ],
             temperature=0.1,
+            stream=True,
         )
 
-        content = response.choices[0].message.content.strip()
+        # Accumulate deltas and stop as soon as both structured fields
+        # have streamed in — latency becomes time-to-both-fields instead
+        # of time-to-full-response.
+        parts = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            if "\n" in delta:
+                # Stop only once both field regexes match with actual
+                # content — a bare "Proposed fix:" header streaming in
+                # must not truncate the response before its body.
+                buffer = "".join(parts)
+                root_m = _ROOT_RE.search(buffer)
+                fix_m = _FIX_RE.search(buffer)
+                if (
+                    root_m and root_m.group(1).strip()
+                    and fix_m and fix_m.group(1).strip()
+                ):
+                    # openai 1.0.0's Stream has no close(); drop the
+                    # underlying HTTP response instead.
+                    if hasattr(stream, "close"):
+                        stream.close()
+                    else:
+                        stream.response.close()
+                    break
+
+        content = "".join(parts).strip()
 
         # VERY simple parsing (interview-friendly)
-        root = ""
-        fix = ""
-
-        for line in content.splitlines():
-            if line.lower().startswith("root cause"):
-                root = line.split(":", 1)[-1].strip()
-            if line.lower().startswith("proposed fix"):
-                fix = line.split(":", 1)[-1].strip()
+        root_m = _ROOT_RE.search(content)
+        fix_m = _FIX_RE.search(content)
+        root = root_m.group(1).strip() if root_m else ""
+        fix = fix_m.group(1).strip() if fix_m else ""
 
         if not root or not fix:
-            return {
+            result = {
                 "root_cause": content,
                 "proposed_fix": "See analysis above.",
             }
+        else:
+            result = {
+                "root_cause": root,
+                "proposed_fix": fix,
+            }
 
-        return {
-            "root_cause": root,
-            "proposed_fix": fix,
-        }
+        if self.cache:
+            self.cache.put(key, self.model, result["root_cause"], result["proposed_fix"])
+
+        return result
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, Optional
+from itertools import groupby
+from typing import List, Dict, Any, Optional, Set
 
 
 def approx_tokens(text: str) -> int:
@@ -13,6 +14,12 @@ def approx_tokens(text: str) -> int:
 class Turn:
     role: str  # "user" | "agent"
     content: str
+    formatted: str = ""  # precomputed "role: content" reused on every render
+    tokens: int = 0  # precomputed once so eviction never re-measures
+
+    def __post_init__(self) -> None:
+        self.formatted = f"{self.role}: {self.content}"
+        self.tokens = approx_tokens(self.formatted)
 
 
 @dataclass
@@ -26,6 +33,10 @@ class BugRecord:
     tests_added: List[str] = field(default_factory=list)
     test_command: str = ""
     test_result_summary: str = ""
+    # Cached analysis so an identical follow-up message replays the
+    # summary instead of re-running the whole analyze pipeline.
+    analysis_text: str = ""
+    analysis_hash: int = 0
 
 
 class ContextStore:
@@ -40,21 +51,51 @@ class ContextStore:
         self.turns: List[Turn] = []
         self.summary: str = ""  # compressed older history
         self.bugs: List[BugRecord] = []
+        self._bug_index: Dict[str, BugRecord] = {}
         self._bug_counter = 0
+        # Running token counters: add_turn/_maybe_compress keep these in
+        # sync so total_tokens() is O(1) instead of rejoining all turns.
+        self._turns_tokens = 0
+        self._summary_tokens = 0
+        # Hashes of summary bullets already emitted, so repeated agent
+        # messages (help/context echoes) are not stored twice.
+        self._seen_summary_lines: Set[int] = set()
+        # Rendered-context cache: rebuilt only after add_turn/new_bug
+        # mark it dirty, so repeated renders with no new state are O(1).
+        self._render_cache: Optional[str] = None
+        self._render_dirty = True
+        # Tracked on write so callers never reverse-scan the turn list.
+        self.last_agent_message: str = ""
 
     def new_bug(self, user_report: str) -> BugRecord:
         self._bug_counter += 1
         bug = BugRecord(bug_id=f"BUG-{self._bug_counter:03d}", user_report=user_report)
         self.bugs.append(bug)
+        self._bug_index[bug.bug_id] = bug
+        self._render_dirty = True
         return bug
 
+    def get_bug(self, bug_id: str) -> BugRecord:
+        return self._bug_index[bug_id]
+
+    def mark_dirty(self) -> None:
+        """
+        Invalidate the rendered-context cache. Call after mutating a
+        BugRecord in place without going through add_turn/new_bug.
+        """
+        self._render_dirty = True
+
     def add_turn(self, role: str, content: str) -> None:
-        self.turns.append(Turn(role=role, content=content))
+        turn = Turn(role=role, content=content)
+        self.turns.append(turn)
+        self._turns_tokens += turn.tokens
+        self._render_dirty = True
+        if role == "agent":
+            self.last_agent_message = content
         self._maybe_compress()
 
     def total_tokens(self) -> int:
-        turns_text = "\n".join([f"{t.role}: {t.content}" for t in self.turns])
-        return approx_tokens(self.summary) + approx_tokens(turns_text)
+        return self._summary_tokens + self._turns_tokens
 
     def _maybe_compress(self) -> None:
         if self.total_tokens() <= self.token_limit:
@@ -64,22 +105,42 @@ class ContextStore:
         cut = max(1, int(len(self.turns) * 0.4))
         old = self.turns[:cut]
         self.turns = self.turns[cut:]
-
-        # Heuristic compression (in a real system, call LLM here)
-        compressed_lines = []
-        for t in old:
-            line = t.content.strip().replace("\n", " ")
+        self._turns_tokens -= sum(t.tokens for t in old)
+
+        # Heuristic compression (in a real system, call LLM here).
+        # Consecutive turns with the same role AND the same (truncated)
+        # content collapse into one "(xN)" bullet, and exact repeats of
+        # earlier bullets are dropped — distinct messages each keep
+        # their own bullet, so no history is silently discarded.
+        def truncate(turn: Turn) -> str:
+            line = turn.content.strip().replace("\n", " ")
             if len(line) > 180:
                 line = line[:180] + "…"
-            compressed_lines.append(f"- {t.role}: {line}")
+            return line
 
-        addition = "Compressed history:\n" + "\n".join(compressed_lines) + "\n"
-        self.summary = (self.summary + "\n" + addition).strip()
+        compressed_lines = []
+        for (role, line), run in groupby(old, key=lambda t: (t.role, truncate(t))):
+            count = sum(1 for _ in run)
+            suffix = f" (x{count})" if count > 1 else ""
+            bullet = f"- {role}{suffix}: {line}"
+            key = hash(bullet)
+            if key in self._seen_summary_lines:
+                continue
+            self._seen_summary_lines.add(key)
+            compressed_lines.append(bullet)
+
+        if compressed_lines:
+            addition = "Compressed history:\n" + "\n".join(compressed_lines) + "\n"
+            self.summary = (self.summary + "\n" + addition).strip()
+            self._summary_tokens = approx_tokens(self.summary)
 
     def render_for_agent(self) -> str:
         """
-        What the agent uses as context.
+        What the agent uses as context. Cached between state changes.
         """
+        if not self._render_dirty and self._render_cache is not None:
+            return self._render_cache
+
         bug_state = []
         for b in self.bugs:
             bug_state.append(
@@ -89,9 +150,12 @@ class ContextStore:
                 f"test_result={b.test_result_summary!r}"
             )
 
-        turns_text = "\n".join([f"{t.role}: {t.content}" for t in self.turns])
-        return (
-            f"=== SUMMARY (compressed) ===\n{self.summary}\n\n"
-            f"=== BUG TRACKER ===\n" + ("\n".join(bug_state) if bug_state else "(none)") + "\n\n"
-            f"=== RECENT TURNS ===\n{turns_text}\n"
-        )
+        # Single join over collected parts — no chained concatenation.
+        parts = [
+            "=== SUMMARY (compressed) ===\n", self.summary, "\n\n",
+            "=== BUG TRACKER ===\n", "\n".join(bug_state) if bug_state else "(none)", "\n\n",
+            "=== RECENT TURNS ===\n", "\n".join(t.formatted for t in self.turns), "\n",
+        ]
+        self._render_cache = "".join(parts)
+        self._render_dirty = False
+        return self._render_cache
@@ -1,26 +1,51 @@
 from __future__ import annotations
 
 import os
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 
+# Directories that never contain project sources worth scanning.
+_SKIP_DIRS = {".git", "node_modules", "__pycache__", ".venv", "venv"}
 
-def list_files(root_dir: str, exts: Tuple[str, ...] = (".py",)) -> List[str]:
-    out: List[str] = []
-    for base, _, files in os.walk(root_dir):
-        for fn in files:
-            if fn.endswith(exts):
-                out.append(os.path.join(base, fn))
-    return out
+# Files above this size are generated/vendored artifacts; skip them.
+_MAX_FILE_BYTES = 2_000_000
+
+
+def list_files(root_dir: str, exts: Tuple[str, ...] = (".py",)) -> Iterator[str]:
+    """
+    Lazily yield matching files. os.scandir reuses the type info the
+    kernel already returned for each entry, avoiding the extra stat per
+    name that os.walk's bookkeeping incurs, and the generator form lets
+    callers stop early without materializing the whole tree.
+    """
+    stack = [root_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in _SKIP_DIRS:
+                            stack.append(entry.path)
+                    elif entry.name.endswith(exts):
+                        yield entry.path
+        except OSError:
+            continue
 
 
 def search_in_repo(root_dir: str, needle: str, exts: Tuple[str, ...] = (".py",)) -> List[str]:
-    needle_l = needle.lower()
+    needle_l = needle.casefold()
     hits: List[str] = []
     for fp in list_files(root_dir, exts=exts):
         try:
-            with open(fp, "r", encoding="utf-8") as f:
-                if needle_l in f.read().lower():
-                    hits.append(fp)
-        except Exception:
+            if os.path.getsize(fp) > _MAX_FILE_BYTES:
+                continue
+            # Stream line-by-line: peak memory stays O(line) and the scan
+            # short-circuits on the first hit instead of reading the rest.
+            with open(fp, "r", encoding="utf-8", errors="ignore") as f:
+                for line in f:
+                    if needle_l in line.casefold():
+                        hits.append(fp)
+                        break
+        except OSError:
             continue
     return hits
@@ -1,16 +1,114 @@
 from __future__ import annotations
 
+import ast
+import asyncio
+import functools
+import hashlib
 import os
+import re
+import shlex
+import shutil
 import subprocess
+from collections import OrderedDict, deque
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import difflib
+import time
+
+from repo_utils import list_files
+
+try:
+    # C-optimized Myers diff; orders of magnitude faster than difflib
+    # on large files. Optional — difflib remains the fallback.
+    from diff_match_patch import diff_match_patch
+except ImportError:
+    diff_match_patch = None
 
 
 class ToolError(Exception):
     pass
 
 
+class ParseCache:
+    """
+    Bounded AST cache keyed by SHA-256 of the source, so re-analyzing or
+    re-fixing unchanged code reuses the parsed module instead of paying
+    for another compile.
+    """
+
+    def __init__(self, maxsize: int = 64) -> None:
+        self._entries: "OrderedDict[str, ast.Module]" = OrderedDict()
+        self._maxsize = maxsize
+
+    def parse(self, source: str) -> ast.Module:
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            return cached
+
+        tree = ast.parse(source)
+        self._entries[key] = tree
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+        return tree
+
+
+# Shared across the process: parses are content-addressed, so a single
+# cache is safe for every caller.
+parse_cache = ParseCache()
+
+# Files above this size are not worth holding in the read cache; source
+# files are almost always far smaller.
+_READ_CACHE_MAX_BYTES = 256 * 1024
+
+# Cap on captured subprocess output; the tail is kept because that is
+# where pytest & co. put their summaries.
+_MAX_CAPTURE_BYTES = 256 * 1024
+
+
+def _truncate_decode(raw: bytes) -> str:
+    return raw[-_MAX_CAPTURE_BYTES:].decode("utf-8", "replace")
+
+
+# Path resolution repeats heavily on hot file ops; abspath costs a
+# getcwd + normalization per call, so memoize per (root, path) pair.
+@functools.lru_cache(maxsize=512)
+def _resolve_path(root_dir: str, file_path: str) -> str:
+    abs_path = os.path.abspath(os.path.join(root_dir, file_path))
+    if not abs_path.startswith(root_dir + os.sep) and abs_path != root_dir:
+        raise ToolError(f"Unsafe path (outside root): {file_path}")
+    return abs_path
+
+
+def _needs_shell(command: str) -> bool:
+    """
+    True when the command relies on shell features (pipes, redirects,
+    env-var assignments like PYTHONPATH=... prefixes). Plain commands
+    can exec directly, skipping the /bin/sh fork.
+    """
+    if any(c in command for c in "|&;<>$`*?\n"):
+        return True
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return True
+    return not argv or "=" in argv[0]
+
+
+@functools.cache
+def _resolve_binary(name: str) -> str:
+    """
+    Memoized PATH lookup for argv[0], so repeated execs of the same tool
+    (pytest, git, ...) don't rescan PATH on every invocation. Names with
+    a path separator are left alone — they resolve against cwd, which
+    differs per Tools instance.
+    """
+    if os.sep in name:
+        return name
+    return shutil.which(name) or name
+
+
 @dataclass
 class BashResult:
     ok: bool
@@ -20,6 +118,46 @@ class BashResult:
     command: str
 
 
+class TestResultCache:
+    """
+    Short-TTL cache of test-run results keyed by a hash of the source
+    tree state, so an immediately repeated run (double-click, repeated
+    'run-tests') with nothing changed skips the whole pytest invocation.
+    """
+
+    def __init__(self, ttl_s: float = 30.0) -> None:
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._entry: Optional[Tuple[str, "BashResult", float]] = None
+
+    @staticmethod
+    def tree_hash(root_dir: str) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        for fp in sorted(list_files(root_dir)):
+            try:
+                st = os.stat(fp)
+            except OSError:
+                continue
+            h.update(f"{fp}\x00{st.st_mtime_ns}\x00{st.st_size}\x00".encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional["BashResult"]:
+        if self._entry is not None:
+            cached_key, result, stamp = self._entry
+            if cached_key == key and time.monotonic() - stamp < self.ttl_s:
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def put(self, key: str, result: "BashResult") -> None:
+        self._entry = (key, result, time.monotonic())
+
+    def invalidate(self) -> None:
+        self._entry = None
+
+
 class PermissionManager:
     """
     Enforces: NO bash command executes without explicit user permission.
@@ -63,12 +201,22 @@ class Tools:
     def __init__(self, permission: PermissionManager, root_dir: str) -> None:
         self.permission = permission
         self.root_dir = os.path.abspath(root_dir)
+        self._root_prefix = self.root_dir + os.sep
+        # Session-scoped file content cache keyed by (mtime_ns, size).
+        # The agent reads the same file in analyze and fix back-to-back;
+        # a matching stat means we can skip the syscall + UTF-8 decode.
+        self._read_cache: Dict[str, Tuple[int, int, str]] = {}
+        self.test_cache = TestResultCache()
+        # Directories already confirmed to exist — skips the stat+mkdir
+        # in makedirs on the hot repeated-write path.
+        self._known_dirs: set = set()
 
     def _safe_path(self, file_path: str) -> str:
-        abs_path = os.path.abspath(os.path.join(self.root_dir, file_path))
-        if not abs_path.startswith(self.root_dir + os.sep) and abs_path != self.root_dir:
-            raise ToolError(f"Unsafe path (outside root): {file_path}")
-        return abs_path
+        # Fast path: an absolute path already under the root with no
+        # '..' segments needs no normalization at all.
+        if file_path.startswith(self._root_prefix) and ".." not in file_path.split(os.sep):
+            return file_path
+        return _resolve_path(self.root_dir, file_path)
 
     # 1) bash(command) — MUST ask permission first
     def bash(self, command: str, timeout_s: int = 60) -> BashResult:
@@ -82,20 +230,131 @@ class Tools:
                 command=command,
             )
 
-        # Execute only after approval
-        proc = subprocess.run(
-            command,
-            shell=True,
-            cwd=self.root_dir,
-            capture_output=True,
-            text=True,
-            timeout=timeout_s,
-        )
+        # Execute only after approval. Output is captured as raw bytes,
+        # capped, and decoded once at the boundary — no unbounded text
+        # buffers or decoding of binary junk. Plain commands exec
+        # directly; only ones using shell features pay the /bin/sh fork.
+        if _needs_shell(command):
+            proc = subprocess.run(
+                command,
+                shell=True,
+                cwd=self.root_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=timeout_s,
+            )
+        else:
+            argv = shlex.split(command)
+            argv[0] = _resolve_binary(argv[0])
+            try:
+                proc = subprocess.run(
+                    argv,
+                    cwd=self.root_dir,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    timeout=timeout_s,
+                )
+            except (FileNotFoundError, PermissionError) as exc:
+                # The shell path reports a missing binary as rc 127;
+                # keep the same BashResult contract here.
+                return BashResult(
+                    ok=False,
+                    returncode=127,
+                    stdout="",
+                    stderr=f"{argv[0]}: {exc}",
+                    command=command,
+                )
         return BashResult(
             ok=(proc.returncode == 0),
             returncode=proc.returncode,
-            stdout=proc.stdout,
-            stderr=proc.stderr,
+            stdout=_truncate_decode(proc.stdout),
+            stderr=_truncate_decode(proc.stderr),
+            command=command,
+        )
+
+    # 1b) bash_async(command) — same permission gate, non-blocking
+    async def bash_async(self, command: str, timeout_s: int = 60, on_line=None) -> BashResult:
+        """
+        Async variant of bash() for the asyncio CLI loop / web backend.
+        Streams stdout line-by-line to `on_line` (if given) so long test
+        runs show progress instead of blocking until completion.
+        """
+        approved = await asyncio.to_thread(self.permission.request, command)
+        if not approved:
+            return BashResult(
+                ok=False,
+                returncode=126,
+                stdout="",
+                stderr="User rejected bash command execution.",
+                command=command,
+            )
+
+        if _needs_shell(command):
+            proc = await asyncio.create_subprocess_shell(
+                command,
+                cwd=self.root_dir,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        else:
+            # argv exec: no intermediate /bin/sh fork for plain commands.
+            argv = shlex.split(command)
+            argv[0] = _resolve_binary(argv[0])
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *argv,
+                    cwd=self.root_dir,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+            except (FileNotFoundError, PermissionError) as exc:
+                return BashResult(
+                    ok=False,
+                    returncode=127,
+                    stdout="",
+                    stderr=f"{argv[0]}: {exc}",
+                    command=command,
+                )
+
+        async def _drain_stdout() -> str:
+            # Every line still streams out via on_line, but the retained
+            # buffer is capped to the tail — same semantics as
+            # _truncate_decode on the sync path.
+            lines: deque = deque()
+            buffered = 0
+            assert proc.stdout is not None
+            async for raw in proc.stdout:
+                line = raw.decode("utf-8", "replace")
+                lines.append(line)
+                buffered += len(line)
+                if on_line is not None:
+                    on_line(line.rstrip("\n"))
+                while buffered > _MAX_CAPTURE_BYTES and len(lines) > 1:
+                    buffered -= len(lines.popleft())
+            return "".join(lines)[-_MAX_CAPTURE_BYTES:]
+
+        try:
+            stdout, stderr_b = await asyncio.wait_for(
+                asyncio.gather(_drain_stdout(), proc.stderr.read()),
+                timeout=timeout_s,
+            )
+            await proc.wait()
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return BashResult(
+                ok=False,
+                returncode=124,
+                stdout="",
+                stderr=f"Command timed out after {timeout_s}s.",
+                command=command,
+            )
+
+        return BashResult(
+            ok=(proc.returncode == 0),
+            returncode=proc.returncode or 0,
+            stdout=stdout,
+            stderr=_truncate_decode(stderr_b),
             command=command,
         )
 
@@ -105,20 +364,66 @@ class Tools:
             abs_path = self._safe_path(file_path)
             if not os.path.exists(abs_path):
                 return False, f"File not found: {file_path}"
+
+            st = os.stat(abs_path)
+            cached = self._read_cache.get(abs_path)
+            if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                return True, cached[2]
+
             with open(abs_path, "r", encoding="utf-8") as f:
-                return True, f.read()
+                content = f.read()
+            if st.st_size <= _READ_CACHE_MAX_BYTES:
+                self._read_cache[abs_path] = (st.st_mtime_ns, st.st_size, content)
+            return True, content
         except Exception as e:
             return False, f"read_file error: {e}"
 
+    # 2b) read_files(paths) — concurrent batch read
+    async def read_files(self, paths: List[str]) -> Dict[str, Tuple[bool, str]]:
+        """
+        Read several files concurrently. Overlaps syscall/decode latency
+        across candidate files so analysis scales with file count.
+        """
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self.read_file, p) for p in paths)
+        )
+        return dict(zip(paths, results))
+
     # 3) write_file(file_path, content)
     def write_file(self, file_path: str, content: str) -> Tuple[bool, str]:
         try:
             abs_path = self._safe_path(file_path)
-            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-            with open(abs_path, "w", encoding="utf-8") as f:
-                f.write(content)
+            parent = os.path.dirname(abs_path)
+            if parent not in self._known_dirs:
+                os.makedirs(parent, exist_ok=True)
+                self._known_dirs.add(parent)
+            # Write-then-rename: concurrent readers see either the old
+            # or the new file, never a torn partial write.
+            tmp_path = abs_path + ".tmp." + os.urandom(4).hex()
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, abs_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            # Refresh the read cache so the next read_file is served from
+            # memory and never sees stale pre-write content.
+            st = os.stat(abs_path)
+            if st.st_size <= _READ_CACHE_MAX_BYTES:
+                self._read_cache[abs_path] = (st.st_mtime_ns, st.st_size, content)
+            else:
+                self._read_cache.pop(abs_path, None)
+            # Source changed: any cached test result is now stale.
+            self.test_cache.invalidate()
             return True, f"Wrote {file_path} ({len(content)} bytes)."
         except Exception as e:
+            # A failed write may leave disk state diverging from what the
+            # memoized diffs were computed against; drop them.
+            _cached_unified_diff.cache_clear()
             return False, f"write_file error: {e}"
 
     # 4) edit_file(file_path, changes)
@@ -128,20 +433,79 @@ class Tools:
             if not ok:
                 return False, old
 
+            # Identical content: a single string compare saves the whole
+            # diff computation and the disk write.
+            if changes == old:
+                print("\n--- Proposed Diff ---")
+                print("(No changes)")
+                print("--- End Diff ---\n")
+                return True, f"No changes for {file_path}."
+
             # show diff for UI visibility
-            diff = "\n".join(
-                difflib.unified_diff(
-                    old.splitlines(),
-                    changes.splitlines(),
-                    fromfile=f"a/{file_path}",
-                    tofile=f"b/{file_path}",
-                    lineterm="",
-                )
-            )
+            diff = self._render_diff(file_path, old, changes)
             print("\n--- Proposed Diff ---")
             print(diff if diff.strip() else "(No changes)")
             print("--- End Diff ---\n")
 
+            # Always the atomic write-then-rename path: an in-place
+            # partial rewrite would expose torn content to a reader
+            # racing the edit, which write_file exists to rule out.
             return self.write_file(file_path, changes)
         except Exception as e:
             return False, f"edit_file error: {e}"
+
+    @staticmethod
+    def _render_diff(file_path: str, old: str, new: str) -> str:
+        if diff_match_patch is not None:
+            dmp = diff_match_patch()
+            dmp.Diff_Timeout = 0.5  # cap worst-case diff cost
+            diffs = dmp.diff_main(old, new)
+            dmp.diff_cleanupSemantic(diffs)
+            return dmp.patch_toText(dmp.patch_make(old, diffs))
+
+        return _cached_unified_diff(old, new, file_path)
+
+
+# Memoized: the agent and the web UI can request the same diff twice
+# (retries, re-render); a repeat (old, new) pair is a dict hit instead
+# of another O(n*m) difflib pass.
+@functools.lru_cache(maxsize=32)
+def _cached_unified_diff(old: str, new: str, file_path: str) -> str:
+    a = old.splitlines()
+    b = new.splitlines()
+
+    # difflib cost is quadratic in the unmatched region, so strip the
+    # identical leading/trailing lines first and shift the hunk headers
+    # back by the trimmed prefix afterwards.
+    i = 0
+    while i < len(a) and i < len(b) and a[i] == b[i]:
+        i += 1
+    j = 0
+    while j < len(a) - i and j < len(b) - i and a[-1 - j] == b[-1 - j]:
+        j += 1
+
+    lines = []
+    for line in difflib.unified_diff(
+        a[i:len(a) - j],
+        b[i:len(b) - j],
+        fromfile=f"a/{file_path}",
+        tofile=f"b/{file_path}",
+        lineterm="",
+    ):
+        if i and line.startswith("@@"):
+            line = _offset_hunk_header(line, i)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+_HUNK_HEADER_RE = re.compile(r"@@ -(\d+)((?:,\d+)?) \+(\d+)((?:,\d+)?) @@")
+
+
+def _offset_hunk_header(header: str, offset: int) -> str:
+    m = _HUNK_HEADER_RE.match(header)
+    if not m:
+        return header
+    return "@@ -{}{} +{}{} @@".format(
+        int(m.group(1)) + offset, m.group(2),
+        int(m.group(3)) + offset, m.group(4),
+    )
@@ -1,16 +1,28 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import os
+import time
 import uuid
-from dataclasses import dataclass
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass
 from typing import Dict, Optional, Any
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+try:
+    # Optional: shared session state for multi-worker deployments.
+    from redis import asyncio as aioredis
+except ImportError:
+    aioredis = None
+
 # Import your existing code
 from tools import Tools, ToolError
-from memory import ContextStore
+from memory import BugRecord, ContextStore, Turn, approx_tokens
 from tools import PermissionManager as CliPermissionManager  # not used for web
 from agent import BugFixerAgent  # uses Tools + ContextStore
 
@@ -48,17 +60,164 @@ class WebPermissionManager:
 
 # --- Session Model ---
 
+# Bounded in-RAM turn window + on-disk archive for long sessions.
+MAX_TURNS_IN_MEMORY = 200
+SPILL_BATCH = 50
+SPILL_DIR = "sessions"
+
+
+class SpillingContextStore(ContextStore):
+    """
+    ContextStore with a bounded in-memory turn window. Every turn is
+    also buffered and appended to sessions/<sid>.jsonl in batches, so a
+    long-running session keeps bounded memory without losing history.
+    """
+
+    def __init__(self, session_id: str, token_limit: int = 8000) -> None:
+        super().__init__(token_limit=token_limit)
+        self.session_id = session_id
+        self._spill_buffer: deque = deque()
+
+    def add_turn(self, role: str, content: str) -> None:
+        super().add_turn(role, content)
+
+        self._spill_buffer.append({"role": role, "content": content})
+        if len(self._spill_buffer) >= SPILL_BATCH:
+            batch = list(self._spill_buffer)
+            self._spill_buffer.clear()
+            self._flush(batch)
+
+        if len(self.turns) > MAX_TURNS_IN_MEMORY:
+            evicted = self.turns[:-MAX_TURNS_IN_MEMORY]
+            self.turns = self.turns[-MAX_TURNS_IN_MEMORY:]
+            self._turns_tokens -= sum(t.tokens for t in evicted)
+            self._render_dirty = True
+
+    def _flush(self, batch) -> None:
+        def write() -> None:
+            os.makedirs(SPILL_DIR, exist_ok=True)
+            path = os.path.join(SPILL_DIR, f"{self.session_id}.jsonl")
+            with open(path, "a", encoding="utf-8") as f:
+                for item in batch:
+                    f.write(json.dumps(item) + "\n")
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Called from a worker thread (asyncio.to_thread) — just write.
+            write()
+        else:
+            loop.run_in_executor(None, write)
+
+
 class SessionState:
-    def __init__(self) -> None:
+    def __init__(self, session_id: str = "local") -> None:
         self.permission = WebPermissionManager()
         self.tools = Tools(permission=self.permission, root_dir=".")
-        self.memory = ContextStore(token_limit=8000)
+        self.memory = SpillingContextStore(session_id, token_limit=8000)
         self.agent = BugFixerAgent(tools=self.tools, memory=self.memory)
         self.latest_diff: str = ""
         self.latest_test_output: str = ""
+        self.last_used: float = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        # Created lazily: SessionState may be constructed before an event
+        # loop exists. Serializes work per session (double-clicks, rapid
+        # posts) while still allowing parallelism across sessions.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+
+# Bounded LRU: newest/most recently used sessions at the end. Keeps a
+# lid on memory — every SessionState carries a full agent + context.
+MAX_SESSIONS = 256
+SESSION_IDLE_TTL_S = 30 * 60
+SESSION_REDIS_TTL_S = 3600
 
+SESSIONS: "OrderedDict[str, SessionState]" = OrderedDict()
+
+
+class SessionStore:
+    """
+    Optional Redis persistence behind the in-process LRU. With
+    uvicorn --workers > 1 each worker has its own SESSIONS dict; a
+    request landing on the wrong worker would otherwise lose pending
+    permission state and force agent re-runs. Only the light,
+    JSON-serializable pieces travel through Redis — agent/tool objects
+    are cheap and rebuilt on rehydration.
+    """
 
-SESSIONS: Dict[str, SessionState] = {}
+    def __init__(self) -> None:
+        url = os.getenv("REDIS_URL")
+        self.redis = aioredis.from_url(url) if (aioredis and url) else None
+
+    @staticmethod
+    def _dump(s: SessionState) -> str:
+        pending = s.permission.pending
+        return json.dumps({
+            "pending": [pending.request_id, pending.command] if pending else None,
+            "last_decision": s.permission.last_decision,
+            "latest_diff": s.latest_diff,
+            "latest_test_output": s.latest_test_output,
+            "turns": [[t.role, t.content] for t in s.memory.turns],
+            "bugs": [asdict(b) for b in s.memory.bugs],
+            "bug_counter": s.memory._bug_counter,
+            "summary": s.memory.summary,
+            "active_bug_id": s.agent.active_bug_id,
+        })
+
+    @staticmethod
+    def _restore(sid: str, payload: str) -> SessionState:
+        data = json.loads(payload)
+        s = SessionState(sid)
+        if data["pending"]:
+            s.permission.pending = PendingBash(*data["pending"])
+        s.permission.last_decision = data["last_decision"]
+        s.latest_diff = data["latest_diff"]
+        s.latest_test_output = data["latest_test_output"]
+        # Rebuild turns directly: the originating worker already spilled
+        # these to the archive, and replaying through add_turn would
+        # re-append them (and re-run compression) on every rehydration.
+        mem = s.memory
+        for role, content in data["turns"]:
+            turn = Turn(role=role, content=content)
+            mem.turns.append(turn)
+            mem._turns_tokens += turn.tokens
+            if role == "agent":
+                mem.last_agent_message = content
+        # Bug tracker, summary, and the active bug travel too —
+        # otherwise a rehydrated session re-logs a fresh BUG-001 and
+        # loses the compressed history.
+        for bug_data in data["bugs"]:
+            bug = BugRecord(**bug_data)
+            mem.bugs.append(bug)
+            mem._bug_index[bug.bug_id] = bug
+        mem._bug_counter = data["bug_counter"]
+        mem.summary = data["summary"]
+        if mem.summary:
+            mem._summary_tokens = approx_tokens(mem.summary)
+        s.agent.active_bug_id = data["active_bug_id"]
+        mem._render_dirty = True
+        return s
+
+    async def persist(self, sid: str, s: SessionState) -> None:
+        if self.redis is None:
+            return
+        await self.redis.set(f"sess:{sid}", self._dump(s), ex=SESSION_REDIS_TTL_S)
+
+    async def load(self, sid: str) -> Optional[SessionState]:
+        if self.redis is None:
+            return None
+        payload = await self.redis.get(f"sess:{sid}")
+        if payload is None:
+            return None
+        return self._restore(sid, payload)
+
+
+SESSION_STORE = SessionStore()
 
 # --- FastAPI app ---
 
@@ -100,33 +259,73 @@ class PermissionRespReq(BaseModel):
 # Easiest interview-safe approach: add a "last_diff" buffer in Tools.edit_file in the future.
 # For now, we keep placeholders.
 
-def get_session(session_id: str) -> SessionState:
-    if session_id not in SESSIONS:
-        SESSIONS[session_id] = SessionState()
-    return SESSIONS[session_id]
+async def get_session(session_id: str) -> SessionState:
+    s = SESSIONS.get(session_id)
+    if s is None:
+        # Another worker may own this session — try rehydrating from
+        # Redis before rejecting.
+        s = await SESSION_STORE.load(session_id)
+        if s is None:
+            # Unknown ids no longer allocate fresh state implicitly — that
+            # made memory growth as cheap as sending random session_ids.
+            raise HTTPException(status_code=404, detail="Unknown session_id")
+        SESSIONS[session_id] = s
+    s.last_used = time.monotonic()
+    SESSIONS.move_to_end(session_id)
+    return s
 
 
 @app.post("/session", response_model=CreateSessionResp)
-def create_session() -> CreateSessionResp:
+async def create_session() -> CreateSessionResp:
     sid = str(uuid.uuid4())
-    SESSIONS[sid] = SessionState()
+    s = SessionState(sid)
+    SESSIONS[sid] = s
+    while len(SESSIONS) > MAX_SESSIONS:
+        SESSIONS.popitem(last=False)  # evict least recently used
+    await SESSION_STORE.persist(sid, s)
     return CreateSessionResp(session_id=sid)
 
 
+@app.on_event("startup")
+async def warmup() -> None:
+    # Build and discard one session so first-use costs (agent/tools
+    # construction, lazy module init) are paid at boot, not on the
+    # first user request.
+    _ = SessionState()
+
+
+@app.on_event("startup")
+async def start_session_sweeper() -> None:
+    async def sweep() -> None:
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.monotonic() - SESSION_IDLE_TTL_S
+            stale = [sid for sid, s in SESSIONS.items() if s.last_used < cutoff]
+            for sid in stale:
+                SESSIONS.pop(sid, None)
+
+    asyncio.create_task(sweep())
+
+
 @app.post("/chat", response_model=ChatResp)
-def chat(req: ChatReq) -> ChatResp:
-    s = get_session(req.session_id)
+async def chat(req: ChatReq) -> ChatResp:
+    s = await get_session(req.session_id)
 
-    # Route message into agent the same way CLI does:
-    # We mimic the CLI by directly calling internal handlers.
-    s.memory.add_turn("user", req.message)
+    async with s.lock:
+        # Route message into agent the same way CLI does:
+        # We mimic the CLI by directly calling internal handlers.
+        s.memory.add_turn("user", req.message)
 
-    # Special: allow "run-tests" from UI
-    if req.message.strip().lower() == "run-tests":
-        # This triggers tools.bash("pytest -q") internally which will create a pending permission request
-        s.agent._run_tests_flow()  # yes, private method, but fine for demo
-    else:
-        s.agent._handle_user_message(req.message)
+        # Agent work is blocking (file I/O, subprocess); run it in the
+        # threadpool so one session's pytest run doesn't stall the loop.
+        # Special: allow "run-tests" from UI
+        if req.message.strip().lower() == "run-tests":
+            # This triggers tools.bash("pytest -q") internally which will create a pending permission request
+            await asyncio.to_thread(s.agent._run_tests_flow)  # yes, private method, but fine for demo
+        else:
+            await asyncio.to_thread(s.agent._handle_user_message, req.message)
+
+        await SESSION_STORE.persist(req.session_id, s)
 
     # If a permission request is pending, return it to frontend
     if s.permission.pending is not None:
@@ -144,7 +343,7 @@ def chat(req: ChatReq) -> ChatResp:
         )
 
     # Otherwise return last agent turn
-    last_agent = next((t.content for t in reversed(s.memory.turns) if t.role == "agent"), "")
+    last_agent = s.memory.last_agent_message
     return ChatResp(
         type="message",
         agent_message=last_agent or "(no response)",
@@ -153,30 +352,80 @@ def chat(req: ChatReq) -> ChatResp:
     )
 
 
+@app.get("/chat/stream")
+async def chat_stream(session_id: str) -> StreamingResponse:
+    """
+    Run the test suite and stream its output as Server-Sent Events, one
+    event per line, instead of buffering the whole run into a single
+    response. The permission gate still applies: an unapproved run
+    emits a permission_request event and ends the stream.
+    """
+    s = await get_session(session_id)
+
+    async def event_gen():
+        queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+
+        async def run():
+            async with s.lock:
+                result = await s.tools.bash_async(
+                    "PYTHONPATH=demo_repo pytest -q",
+                    on_line=queue.put_nowait,
+                )
+                s.agent._record_test_result(result)
+                s.latest_test_output = result.stdout or result.stderr
+                await SESSION_STORE.persist(session_id, s)
+                queue.put_nowait(None)  # end-of-stream sentinel
+                return result
+
+        task = asyncio.create_task(run())
+        while True:
+            line = await queue.get()
+            if line is None:
+                break
+            yield f"data: {json.dumps({'type': 'line', 'line': line})}\n\n"
+
+        result = await task
+        if result.returncode == 126 and s.permission.pending is not None:
+            pb = s.permission.pending
+            event = {
+                "type": "permission_request",
+                "request_id": pb.request_id,
+                "command": pb.command,
+            }
+        else:
+            event = {"type": "result", "ok": result.ok, "returncode": result.returncode}
+        yield f"data: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(event_gen(), media_type="text/event-stream")
+
+
 @app.post("/permission/respond", response_model=ChatResp)
-def permission_respond(req: PermissionRespReq) -> ChatResp:
-    s = get_session(req.session_id)
+async def permission_respond(req: PermissionRespReq) -> ChatResp:
+    s = await get_session(req.session_id)
 
-    # Validate request_id
-    if not s.permission.pending or s.permission.pending.request_id != req.request_id:
-        return ChatResp(
-            type="message",
-            agent_message="No matching permission request found.",
-        )
+    async with s.lock:
+        # Validate request_id
+        if not s.permission.pending or s.permission.pending.request_id != req.request_id:
+            return ChatResp(
+                type="message",
+                agent_message="No matching permission request found.",
+            )
 
-    # Record decision
-    s.permission.last_decision = req.approved
+        # Record decision
+        s.permission.last_decision = req.approved
 
-    if not req.approved:
-        return ChatResp(
-            type="message",
-            agent_message="Understood — I will not execute that bash command.",
-        )
+        if not req.approved:
+            return ChatResp(
+                type="message",
+                agent_message="Understood — I will not execute that bash command.",
+            )
+
+        # Re-run the test flow: now request() will return True and bash will execute
+        await asyncio.to_thread(s.agent._run_tests_flow)
 
-    # Re-run the test flow: now request() will return True and bash will execute
-    s.agent._run_tests_flow()
+        await SESSION_STORE.persist(req.session_id, s)
 
-    last_agent = next((t.content for t in reversed(s.memory.turns) if t.role == "agent"), "")
+    last_agent = s.memory.last_agent_message
     return ChatResp(
         type="message",
         agent_message=last_agent or "Tests executed.",
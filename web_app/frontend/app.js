@@ -46,8 +46,42 @@ async function ensureSession() {
   return sessionId;
 }
 
+function runTestsStream() {
+  addMsg("user", "run-tests");
+  testBox.textContent = "";
+
+  // Stream test output line-by-line over SSE instead of waiting for
+  // the buffered /chat response.
+  const es = new EventSource(`${API_BASE}/chat/stream?session_id=${sessionId}`);
+  es.onmessage = (e) => {
+    const data = JSON.parse(e.data);
+    if (data.type === "line") {
+      testBox.textContent += data.line + "\n";
+      testBox.scrollTop = testBox.scrollHeight;
+      return;
+    }
+    es.close();
+    if (data.type === "permission_request") {
+      addMsg("agent", `Permission required to run: ${data.command}`);
+      showPermissionModal(data.command, data.request_id);
+    } else {
+      addMsg("agent", `Test run ${data.ok ? "PASSED" : "FAILED"} (exit code ${data.returncode}).`);
+    }
+  };
+  es.onerror = () => {
+    es.close();
+    addMsg("agent", "Test stream disconnected.");
+  };
+}
+
 async function sendChat(text) {
   await ensureSession();
+
+  if (text.toLowerCase() === "run-tests") {
+    runTestsStream();
+    return;
+  }
+
   addMsg("user", text);
 
   const res = await fetch(`${API_BASE}/chat`, {